@@ -1,14 +1,24 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from functools import lru_cache
 import os
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pdf_extractor.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# asyncio drivers used in place of the default sync ones
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Stored as JSONB on PostgreSQL so rows aren't re-parsed from text on every read
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 Base = declarative_base()
 
 
@@ -20,20 +30,43 @@ class ExtractedData(Base):
     filename = Column(String, index=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     raw_text = Column(Text)  # Full extracted text
-    extracted_data = Column(JSON)  # Structured extracted data
-    pdf_metadata = Column(JSON)  # PDF metadata (author, title, etc.)
+    extracted_data = Column(JSONType)  # Structured extracted data
+    pdf_metadata = Column(JSONType)  # PDF metadata (author, title, etc.)
+
+
+def _async_database_url(database_url: str):
+    """Swap a plain sqlite:// or postgresql:// URL to its asyncio driver"""
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+@lru_cache(maxsize=1)
+def get_engine() -> AsyncEngine:
+    """Create the async engine once per process"""
+    url = _async_database_url(DATABASE_URL)
+    # aiosqlite opens a connection per checkout, so only size the pool for server databases
+    pool_args = {} if url.get_backend_name() == "sqlite" else {"pool_size": 20}
+    return create_async_engine(url, pool_pre_ping=True, query_cache_size=1200, **pool_args)
+
+
+@lru_cache(maxsize=1)
+def get_sessionmaker() -> async_sessionmaker:
+    """
+    Session factory bound to the engine.
+    
+    Objects aren't expired on commit, so reading a record after saving it
+    doesn't cost another SELECT.
+    """
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False, autoflush=False)
 
 
 # Create tables
-def init_db():
-    Base.metadata.create_all(bind=engine)
+async def init_db():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 
-def get_db():
+async def get_db():
     """Dependency for getting database session"""
-    db = SessionLocal()
-    try:
+    async with get_sessionmaker()() as db:
         yield db
-    finally:
-        db.close()
-
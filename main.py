@@ -1,19 +1,153 @@
+from cachetools import TTLCache
 from fastapi import FastAPI, File, UploadFile, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from database import get_db, init_db, ExtractedData
-from pdf_extractor import extract_pdf_data
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from sqlalchemy import bindparam, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from database import get_db, get_sessionmaker, init_db, ExtractedData
+from pdf_extractor import extract_pdf_data, iter_extract_pdf_data
+from starlette.background import BackgroundTask
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import cpu_count, get_context
+import asyncio
+import itertools
+import orjson
 import os
+import shutil
 import tempfile
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from datetime import datetime
 
-app = FastAPI(title="PDF Extractor API", version="1.0.0")
+# orjson serializes the large extracted_data/raw_text payloads much faster
+# than the stdlib json used by the default JSONResponse
+app = FastAPI(title="PDF Extractor API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Upload types accepted by /extract (PDFs and images)
+ALLOWED_EXTENSIONS = frozenset({'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.heic', '.heif'})
+
+# Uploads are copied to disk in chunks of this size rather than read whole
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Uploads up to this size are parsed from memory without a temporary file
+IN_MEMORY_UPLOAD_LIMIT = 8 << 20
+
+# Built once with bound offset/limit so every page request reuses the same
+# compiled statement from SQLAlchemy's cache. Listings never return the
+# full raw_text, so it isn't loaded.
+_LIST_COLUMNS = load_only(
+    ExtractedData.id,
+    ExtractedData.filename,
+    ExtractedData.upload_date,
+    ExtractedData.extracted_data,
+    ExtractedData.pdf_metadata
+)
+LIST_STMT = (
+    select(ExtractedData)
+    .options(_LIST_COLUMNS)
+    .order_by(ExtractedData.id)
+    .offset(bindparam("skip"))
+    .limit(bindparam("limit"))
+)
+# Keyset variant for ?after_id=, which seeks on the primary key instead of
+# scanning past skipped rows with OFFSET
+KEYSET_LIST_STMT = (
+    select(ExtractedData)
+    .options(_LIST_COLUMNS)
+    .where(ExtractedData.id > bindparam("after_id"))
+    .order_by(ExtractedData.id)
+    .limit(bindparam("limit"))
+)
+COUNT_STMT = select(func.count(ExtractedData.id))
+
+# Records are written once and rarely change, so /extracted/{id} responses
+# are cached for a short while, keyed by (record_id, include_text). Entries
+# are the serialized JSON bodies, so the cache is sized by their real length
+# in bytes (a response can hold megabytes of text and key-value pairs) and
+# hits skip serialization. It is private to each server process: with
+# WEB_CONCURRENCY > 1, a deleted record can still be served by another
+# worker until its entry expires.
+RECORD_CACHE_BYTES = 64 << 20
+RECORD_CACHE = TTLCache(maxsize=RECORD_CACHE_BYTES, ttl=60, getsizeof=len)
+RECORD_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# Processes in each server worker's PDF parsing pool
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", cpu_count()))
+
+# Files from /extract_batch read and extracted at once per server worker,
+# across all batch requests. Each holds an upload in memory and a
+# threadpool thread while it waits on the parsing pool, so this stays well
+# under anyio's default of 40 threads shared with every other endpoint.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", min(PARSE_WORKERS, 8)))
+# Created on startup so it belongs to the server's event loop
+_batch_slots: Optional[asyncio.Semaphore] = None
+
+# Times an extraction is tried when a parse worker dies (e.g. OOM-killed)
+# and takes the pool down with it
+PARSE_ATTEMPTS = 2
+
+# All CPU-bound parsing, including the page ranges of large PDFs, runs in
+# this one pool so concurrent uploads can't multiply worker processes
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Get this server worker's PDF parsing pool, creating it on first use.
+    
+    Pool processes are spawned rather than forked, as forking a server
+    worker that already runs threads isn't safe (and fork isn't available
+    on Windows or the default on macOS).
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=get_context("spawn"))
+    return _parse_pool
+
+
+def _reset_parse_pool(pool: ProcessPoolExecutor):
+    """
+    Drop a broken parsing pool so the next _get_parse_pool() call builds a
+    fresh one. A pool another request has already replaced is left alone.
+    """
+    global _parse_pool
+    if _parse_pool is pool:
+        _parse_pool = None
+    # Its pending futures have already failed, so there is nothing to wait for
+    pool.shutdown(wait=False)
+
+
+async def _run_in_parse_pool(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run func(*args, pool) in the threadpool with the shared parsing pool.
+    
+    If the pool breaks, it is replaced and func is tried again, up to
+    PARSE_ATTEMPTS times in all.
+    """
+    for attempt in range(1, PARSE_ATTEMPTS + 1):
+        pool = _get_parse_pool()
+        try:
+            return await run_in_threadpool(func, *args, pool)
+        except BrokenProcessPool:
+            _reset_parse_pool(pool)
+            if attempt == PARSE_ATTEMPTS:
+                raise
+
 
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    global _batch_slots
+    _batch_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    await init_db()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
 
 
 @app.get("/")
@@ -22,85 +156,247 @@ async def root():
         "message": "PDF Extractor API",
         "endpoints": {
             "upload": "/extract",
+            "batch_upload": "/extract_batch",
             "list": "/extracted",
-            "get_by_id": "/extracted/{id}"
+            "get_by_id": "/extracted/{id}",
+            "cache_stats": "/cache_stats"
         }
     }
 
 
 @app.post("/extract")
-async def extract_pdf(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
+async def extract_pdf(file: UploadFile = File(...)):
     """
     Upload a PDF file and extract all data from it.
     The extracted data will be saved to the database.
+    
+    The response is newline-delimited JSON: one {"page", "text"} line per
+    page as it is extracted, then a summary line with the saved record's id
+    (or an {"error"} line if processing failed part way).
     """
     # Validate file type (accept PDFs and images)
-    allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.heic', '.heif']
     file_ext = os.path.splitext(file.filename.lower())[1]
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="File must be a PDF or image file")
     
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        try:
-            # Write uploaded file to temporary file
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-            
-            # Extract data from PDF
-            extracted_data = extract_pdf_data(tmp_file_path)
-            
-            # Save to database
-            db_record = ExtractedData(
-                filename=file.filename,
-                raw_text=extracted_data["raw_text"],
-                extracted_data=extracted_data["structured_data"],
-                pdf_metadata=extracted_data["metadata"]
-            )
+    tmp_file_path = None
+    try:
+        source, tmp_file_path = await _read_upload(file)
+        
+        # Start extracting before responding so unreadable files still
+        # get a proper error status
+        first_event, events, pool = await _run_in_parse_pool(_start_extraction, source)
+        
+    except Exception as e:
+        if tmp_file_path:
+            _remove_temp_file(tmp_file_path)
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    
+    # Any temporary file is cleaned up once the whole response has been sent
+    return StreamingResponse(
+        _stream_extraction(first_event, events, pool, file.filename),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(_remove_temp_file, tmp_file_path) if tmp_file_path else None
+    )
+
+
+def _start_extraction(
+    source: Union[str, bytes],
+    pool: ProcessPoolExecutor
+) -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]], ProcessPoolExecutor]:
+    """Begin extracting in pool, returning the first event, the rest of the events and the pool"""
+    events = iter_extract_pdf_data(source, pool)
+    return next(events), events, pool
+
+
+async def _stream_extraction(
+    first_event: Dict[str, Any],
+    events: Iterator[Dict[str, Any]],
+    pool: ProcessPoolExecutor,
+    filename: str
+) -> AsyncIterator[bytes]:
+    """
+    Yield one JSON line per extracted page as it is parsed, then save the
+    record and yield a summary line with its id.
+    
+    This runs after the endpoint has returned, so it opens its own session
+    rather than relying on the request's get_db dependency staying open.
+    """
+    try:
+        # The event stream waits on the process pool from a worker thread
+        async for event in iterate_in_threadpool(itertools.chain([first_event], events)):
+            if "page" in event:
+                yield _ndjson_line(event)
+            else:
+                extracted_data = event["result"]
+        
+        # Save to database once every page has been sent
+        db_record = ExtractedData(
+            filename=filename,
+            raw_text=extracted_data["raw_text"],
+            extracted_data=extracted_data["structured_data"],
+            pdf_metadata=extracted_data["metadata"]
+        )
+        async with get_sessionmaker()() as db:
             db.add(db_record)
-            db.commit()
-            db.refresh(db_record)
-            
-            return {
-                "message": "PDF extracted successfully",
-                "id": db_record.id,
-                "filename": db_record.filename,
-                "upload_date": db_record.upload_date.isoformat(),
-                "extracted_data": {
-                    "pages": extracted_data["pages"],
-                    "tables_count": len(extracted_data["tables"]),
-                    "text_length": len(extracted_data["raw_text"]),
-                    "structured_data": extracted_data["structured_data"],
-                    "metadata": extracted_data["metadata"]
-                }
-            }
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+            await db.commit()
         
+        yield _ndjson_line(dict(
+            message="PDF extracted successfully",
+            **_extraction_summary(db_record.id, db_record.filename, db_record.upload_date, extracted_data)
+        ))
+    
+    except Exception as e:
+        # Pages have already been sent, so this upload can't be retried,
+        # but later ones shouldn't hit the same broken pool
+        if isinstance(e, BrokenProcessPool):
+            _reset_parse_pool(pool)
+        # The status line has already gone out, so report errors in-band
+        yield _ndjson_line({"error": f"Error processing PDF: {str(e)}"})
+    
+    finally:
+        events.close()
+
+
+@app.post("/extract_batch")
+async def extract_pdf_batch(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Upload several PDF/image files and extract all data from them.
+    Files are extracted concurrently (up to BATCH_CONCURRENCY at a time)
+    and saved to the database together with a single INSERT ... RETURNING
+    and one commit.
+    """
+    # Validate file types (accept PDFs and images)
+    for file in files:
+        file_ext = os.path.splitext(file.filename.lower())[1]
+        if file_ext not in ALLOWED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: File must be a PDF or image file")
+    
+    try:
+        extracted = await asyncio.gather(*(_extract_upload(file) for file in files))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    
+    # Save to database
+    rows = [
+        {
+            "filename": file.filename,
+            "raw_text": extracted_data["raw_text"],
+            "extracted_data": extracted_data["structured_data"],
+            "pdf_metadata": extracted_data["metadata"]
+        }
+        for file, extracted_data in zip(files, extracted)
+    ]
+    stmt = insert(ExtractedData).returning(
+        ExtractedData.id, ExtractedData.upload_date, sort_by_parameter_order=True
+    )
+    saved = (await db.execute(stmt, rows)).all()
+    await db.commit()
+    
+    return {
+        "message": f"{len(files)} files extracted successfully",
+        "records": [
+            _extraction_summary(record_id, file.filename, upload_date, extracted_data)
+            for file, extracted_data, (record_id, upload_date) in zip(files, extracted, saved)
+        ]
+    }
+
+
+async def _read_upload(file: UploadFile) -> Tuple[Union[str, bytes], Optional[str]]:
+    """
+    Get an upload ready for extraction.
+    
+    Returns (source, tmp_file_path): the contents and None for small
+    uploads, or the path of a temporary file holding larger ones.
+    """
+    if file.size is not None and file.size <= IN_MEMORY_UPLOAD_LIMIT:
+        # Small uploads are parsed straight from memory, skipping the
+        # temporary file write and unlink
+        return await file.read(), None
+    
+    # Stream larger uploads to a temporary file in fixed-size chunks,
+    # off the event loop, so memory use doesn't grow with file size
+    # and worker processes can map the file by path
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        try:
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp_file, UPLOAD_CHUNK_SIZE)
+        except Exception:
+            tmp_file.close()
+            _remove_temp_file(tmp_file.name)
+            raise
+    return tmp_file.name, tmp_file.name
+
+
+async def _extract_upload(file: UploadFile) -> Dict[str, Any]:
+    """
+    Extract all data from one upload using the shared process pool, once
+    one of the BATCH_CONCURRENCY slots is free.
+    """
+    async with _batch_slots:
+        tmp_file_path = None
+        try:
+            source, tmp_file_path = await _read_upload(file)
+            return await _run_in_parse_pool(extract_pdf_data, source)
         finally:
-            # Clean up temporary file
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
+            if tmp_file_path:
+                _remove_temp_file(tmp_file_path)
+
+
+def _extraction_summary(record_id: int, filename: str, upload_date: datetime, extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe a saved extraction the way the upload endpoints report it"""
+    return {
+        "id": record_id,
+        "filename": filename,
+        "upload_date": upload_date.isoformat(),
+        "extracted_data": {
+            "pages": extracted_data["pages"],
+            "tables_count": len(extracted_data["tables"]),
+            "text_length": len(extracted_data["raw_text"]),
+            "structured_data": extracted_data["structured_data"],
+            "metadata": extracted_data["metadata"]
+        }
+    }
+
+
+def _ndjson_line(data: Dict[str, Any]) -> bytes:
+    """Serialize one newline-delimited JSON record"""
+    return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _remove_temp_file(path: str):
+    """Clean up temporary file"""
+    # A single unlink, with no exists() check to race against
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
 
 
 @app.get("/extracted")
 async def list_extracted(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """
     List all extracted PDF records.
+    Pass after_id (the previous page's next_after_id) instead of skip
+    to page through large tables efficiently.
     """
-    records = db.query(ExtractedData).offset(skip).limit(limit).all()
+    if after_id is not None:
+        result = await db.execute(KEYSET_LIST_STMT, {"after_id": after_id, "limit": limit})
+    else:
+        result = await db.execute(LIST_STMT, {"skip": skip, "limit": limit})
+    records = result.scalars().all()
+    total = (await db.execute(COUNT_STMT)).scalar()
     
     return {
-        "total": len(records),
+        "total": total,
+        "next_after_id": records[-1].id if records and len(records) == limit else None,
         "records": [
             {
                 "id": record.id,
@@ -117,14 +413,21 @@ async def list_extracted(
 @app.get("/extracted/{record_id}")
 async def get_extracted(
     record_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     include_text: bool = False
 ):
     """
     Get a specific extracted PDF record by ID.
     Set include_text=true to include the full raw text.
     """
-    record = db.query(ExtractedData).filter(ExtractedData.id == record_id).first()
+    cache_key = (record_id, include_text)
+    cached = RECORD_CACHE.get(cache_key)
+    if cached is not None:
+        RECORD_CACHE_STATS["hits"] += 1
+        return Response(content=cached, media_type="application/json")
+    RECORD_CACHE_STATS["misses"] += 1
+    
+    record = await db.get(ExtractedData, record_id)
     
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
@@ -140,29 +443,73 @@ async def get_extracted(
     if include_text:
         response["raw_text"] = record.raw_text
     
-    return response
+    body = orjson.dumps(response)
+    # Responses bigger than the whole budget are served uncached
+    if len(body) <= RECORD_CACHE.maxsize:
+        RECORD_CACHE[cache_key] = body
+    return Response(content=body, media_type="application/json")
 
 
 @app.delete("/extracted/{record_id}")
 async def delete_extracted(
     record_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a specific extracted PDF record by ID.
     """
-    record = db.query(ExtractedData).filter(ExtractedData.id == record_id).first()
+    record = await db.get(ExtractedData, record_id)
     
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     
-    db.delete(record)
-    db.commit()
+    await db.delete(record)
+    await db.commit()
+    
+    # Drop any cached responses for the deleted record
+    RECORD_CACHE.pop((record_id, True), None)
+    RECORD_CACHE.pop((record_id, False), None)
     
     return {"message": "Record deleted successfully"}
 
 
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Get hit/miss counts for the /extracted/{id} response cache.
+    size and maxsize are in bytes.
+    """
+    hits = RECORD_CACHE_STATS["hits"]
+    misses = RECORD_CACHE_STATS["misses"]
+    lookups = hits + misses
+    
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "size": RECORD_CACHE.currsize,
+        "maxsize": RECORD_CACHE.maxsize,
+        "ttl": RECORD_CACHE.ttl
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    
+    # One server process by default: parsing runs in its process pool, which
+    # gets every core, and the record cache stays consistent
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    # Split the cores between server workers so their parsing pools don't
+    # oversubscribe the CPU between them
+    os.environ.setdefault("PARSE_WORKERS", str(max(1, cpu_count() // workers)))
+    
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        log_level="warning"
+    )
 
@@ -1,7 +1,19 @@
 import pdfplumber
-from typing import Dict, Any, List
+import pymupdf
+from typing import Dict, Any, BinaryIO, List, Tuple, Iterator, Iterable, Optional, Union
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+import io
+import itertools
 import json
+import math
+import mmap
 import os
+import re
+import subprocess
 
 # Try to register HEIF opener if available
 try:
@@ -10,11 +22,66 @@ try:
 except ImportError:
     pass
 
+# Extraction strategy rules, checked in order by page count. The first rule
+# whose max_pages covers the document is used (None means no upper bound).
+# - batch: parse every page inline in a single pass
+# - stream: parse inline batch_size pages at a time, flushing each batch's
+#   parsed page objects so memory stays flat
+# - processes: split into chunk_size page ranges parsed by up to max_workers
+#   worker processes (None means cpu_count()), each streaming its range
+# When a shared executor is passed in, batch and stream also run in it: the
+# whole document as one range, or one batch_size range at a time.
+STRATEGY_RULES = {
+    "tiny": {"max_pages": 10, "method": "batch", "chunk_size": None, "batch_size": None, "max_workers": 1},
+    "medium": {"max_pages": 200, "method": "stream", "chunk_size": None, "batch_size": 25, "max_workers": 1},
+    "large": {"max_pages": None, "method": "processes", "chunk_size": 50, "batch_size": 25, "max_workers": None},
+}
 
-def extract_pdf_data(pdf_path: str) -> Dict[str, Any]:
+# Extra tesseract flags: LSTM engine only, and treat each image as a single
+# uniform block of text
+TESSERACT_ARGS = ['--oem', '1', '--psm', '6']
+# Frames of multi-page images (TIFF, HEIC) are OCR'd by this many threads
+OCR_MAX_WORKERS = min(4, cpu_count())
+
+_IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.heic', '.heif'})
+# File type by leading magic bytes (4, 3 or 2 bytes long)
+_MAGIC = {
+    b'%PDF': "pdf",
+    b'\x89PNG': "image",
+    b'GIF8': "image",
+    b'II*\x00': "image",  # TIFF, little-endian
+    b'MM\x00*': "image",  # TIFF, big-endian
+    b'\xff\xd8\xff': "image",  # JPEG
+    b'BM': "image",
+}
+
+# "Key: Value" lines, matched over the whole text in one pass. Keys are up
+# to 200 non-colon characters; surrounding whitespace is dropped and lines
+# with an empty key or value don't match. Key and value are greedy and end
+# on a non-space, so long runs of spaces are scanned once instead of
+# re-tried at every position.
+_KV_RE = re.compile(r'(?m)^[^\S\n]*([^:\s](?:[^:\n]{0,198}[^:\s])?)[^\S\n]*:[^\S\n]*(\S(?:.*\S)?)[^\S\n]*$')
+# Single lines, so the sample can be taken without splitting the whole text
+_LINE_RE = re.compile(r'(?m)^.*$')
+# Only this many lines, and at most this many characters, are searched for
+# "Key: Value" pairs, so long unstructured documents (or one very long line)
+# can't build an unbounded dict or take unbounded time
+MAX_KV_LINES = 10_000
+MAX_KV_CHARS = 1 << 20
+
+# (page_texts, tables) for a run of pages, where page_texts holds
+# (page_num, text) for each page that has text
+PageResults = Tuple[List[Tuple[int, str]], List[Dict]]
+
+
+def extract_pdf_data(source: Union[str, bytes, BinaryIO], executor: Optional[Executor] = None) -> Dict[str, Any]:
     """
     Extract all data from a PDF file or image file (using OCR).
     
+    source is a file path, the file's contents, or a binary file object.
+    If executor (a process pool) is given, all parsing runs in it instead
+    of the calling process.
+    
     Returns a dictionary containing:
     - raw_text: All text content from the PDF/image
     - tables: List of tables found in the PDF
@@ -22,6 +89,70 @@ def extract_pdf_data(pdf_path: str) -> Dict[str, Any]:
     - pages: Number of pages
     - structured_data: Extracted structured data (customize based on your PDF structure)
     """
+    return _final_result(iter_extract_pdf_data(source, executor))
+
+
+def extract_pdf_data_from_bytes(buf: Union[bytes, mmap.mmap], executor: Optional[Executor] = None) -> Dict[str, Any]:
+    """
+    Extract all data from a PDF held in memory (bytes or an mmap).
+    
+    Returns the same dictionary as extract_pdf_data.
+    """
+    # Worker processes can't share the buffer, so they get their own copy
+    return _final_result(_iter_extract_pdf(buf, None, executor))
+
+
+def iter_extract_pdf_data(source: Union[str, bytes, BinaryIO], executor: Optional[Executor] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Extract all data from a PDF file or image file, yielding pages as they
+    are parsed. source is the same as for extract_pdf_data.
+    
+    Yields {"page": n, "text": ...} for each page with text, in page order,
+    then a final {"result": ...} holding the dictionary extract_pdf_data
+    returns.
+    """
+    # File objects are read into memory; paths are mapped later on
+    if not isinstance(source, (str, bytes)):
+        source = source.read()
+    
+    # Check if file is an image
+    file_type = _detect_file_type(source)
+    
+    if file_type == "image":
+        if executor is not None:
+            extracted_data, page_texts = executor.submit(_extract_from_image, source).result()
+        else:
+            extracted_data, page_texts = _extract_from_image(source)
+        # One event per frame, like the pages of a PDF
+        for page_num, page_text in page_texts:
+            yield {"page": page_num, "text": page_text}
+        yield {"result": extracted_data}
+        return
+    
+    # A file is memory-mapped, and worker processes re-map it by path;
+    # contents are parsed in place and copied to workers
+    yield from _iter_extract_pdf(source, source, executor)
+
+
+def _final_result(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Drain an extraction event stream and return its final result"""
+    for event in events:
+        if "result" in event:
+            return event["result"]
+
+
+def _iter_extract_pdf(
+    source: Union[str, bytes, mmap.mmap],
+    worker_source: Optional[Union[str, bytes]],
+    executor: Optional[Executor] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Extract all data from a PDF given as a path or in-memory buffer,
+    yielding the same events as iter_extract_pdf_data.
+    
+    worker_source is what gets sent to worker processes when pages are
+    parsed there; None means a copy of the buffer.
+    """
     extracted_data = {
         "raw_text": "",
         "tables": [],
@@ -30,14 +161,8 @@ def extract_pdf_data(pdf_path: str) -> Dict[str, Any]:
         "structured_data": {}
     }
     
-    # Check if file is an image
-    file_type = _detect_file_type(pdf_path)
-    
-    if file_type == "image":
-        return _extract_from_image(pdf_path)
-    
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with _open_documents(source) as (doc, pdf):
             # Extract metadata
             extracted_data["metadata"] = {
                 "title": pdf.metadata.get("Title", ""),
@@ -49,41 +174,202 @@ def extract_pdf_data(pdf_path: str) -> Dict[str, Any]:
                 "modification_date": str(pdf.metadata.get("ModDate", ""))
             }
             
-            extracted_data["pages"] = len(pdf.pages)
+            num_pages = len(doc)
+            extracted_data["pages"] = num_pages
             
-            # Extract text from all pages
+            # Pick how to walk the pages based on document size
+            strategy = _choose_strategy(num_pages)
+            if executor is not None or strategy["method"] == "processes":
+                if worker_source is None:
+                    worker_source = bytes(source)
+                results = _extract_in_processes(worker_source, num_pages, strategy, executor)
+            elif strategy["method"] == "stream":
+                results = _iter_page_batches(doc, pdf, 0, num_pages, strategy["batch_size"])
+            else:
+                results = [_extract_pages(doc, pdf, 0, num_pages)]
+            
+            # Concatenate the per-range/per-batch results in page order,
+            # passing each page on as soon as its batch is done. Results
+            # are produced lazily, so this must run while the PDF is open.
             all_text = []
             all_tables = []
-            
-            for page_num, page in enumerate(pdf.pages, start=1):
-                # Extract text
-                page_text = page.extract_text()
-                if page_text:
+            for page_texts, tables in results:
+                for page_num, page_text in page_texts:
                     all_text.append(f"--- Page {page_num} ---\n{page_text}")
-                
-                # Extract tables
-                tables = page.extract_tables()
-                if tables:
-                    for table_num, table in enumerate(tables):
-                        all_tables.append({
-                            "page": page_num,
-                            "table_number": table_num + 1,
-                            "data": table
-                        })
-            
-            extracted_data["raw_text"] = "\n\n".join(all_text)
-            extracted_data["tables"] = all_tables
-            
-            # Extract structured data (customize this based on your PDF structure)
-            extracted_data["structured_data"] = extract_structured_data(
-                extracted_data["raw_text"],
-                extracted_data["tables"]
-            )
-            
+                    yield {"page": page_num, "text": page_text}
+                all_tables.extend(tables)
+        
+        extracted_data["raw_text"] = "\n\n".join(all_text)
+        # This generator stays suspended at its final yield until the caller
+        # is done with the result, so drop the per-page copies of the text
+        # rather than hold it twice
+        del all_text, results
+        page_texts = page_text = None
+        extracted_data["tables"] = all_tables
+        
+        # Extract structured data (customize this based on your PDF structure)
+        extracted_data["structured_data"] = extract_structured_data(
+            extracted_data["raw_text"],
+            extracted_data["tables"]
+        )
+        
+    except BrokenProcessPool:
+        # Passed on as is so the pool's owner can replace it
+        raise
     except Exception as e:
         raise Exception(f"Error extracting PDF data: {str(e)}")
     
-    return extracted_data
+    yield {"result": extracted_data}
+
+
+def _choose_strategy(num_pages: int) -> Dict[str, Any]:
+    """Return the extraction strategy config from STRATEGY_RULES for a page count"""
+    # Falls through to the last rule if none of the bounds cover num_pages
+    for name, rule in STRATEGY_RULES.items():
+        if rule["max_pages"] is None or num_pages <= rule["max_pages"]:
+            break
+
+    strategy = dict(rule, name=name)
+    if strategy["max_workers"] is None:
+        strategy["max_workers"] = cpu_count()
+    return strategy
+
+
+def _extract_in_processes(
+    source: Union[str, bytes],
+    num_pages: int,
+    strategy: Dict[str, Any],
+    executor: Optional[Executor] = None
+) -> Iterator[PageResults]:
+    """
+    Split a PDF into page ranges and parse them in worker processes,
+    yielding each range's results in page order as they finish.
+    
+    Uses executor if given, otherwise a pool sized for this document.
+    At most max_workers ranges are in flight at once.
+    """
+    if strategy["method"] == "processes":
+        range_size = strategy["chunk_size"]
+    elif strategy["method"] == "stream":
+        range_size = strategy["batch_size"]
+    else:
+        range_size = num_pages
+    range_size = max(range_size, 1)
+    
+    if executor is None:
+        workers = min(strategy["max_workers"], math.ceil(num_pages / range_size))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from _extract_in_processes(source, num_pages, strategy, pool)
+        return
+    
+    ranges = iter([
+        (start, min(start + range_size, num_pages))
+        for start in range(0, num_pages, range_size)
+    ])
+    
+    def submit(page_range):
+        start, end = page_range
+        return executor.submit(_extract_page_range, source, start, end, strategy["batch_size"])
+    
+    pending = deque(submit(page_range) for page_range in itertools.islice(ranges, strategy["max_workers"]))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            # Keep the workers busy while the caller handles this range
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(submit(next_range))
+            yield result
+    finally:
+        # Don't leave queued ranges behind if the caller stops early
+        for future in pending:
+            future.cancel()
+
+
+def _extract_page_range(source: Union[str, bytes], start: int, end: int, batch_size: Optional[int] = None) -> PageResults:
+    """
+    Extract text and tables from pages [start, end) of a PDF.
+    
+    Top-level so it can be dispatched to worker processes; opens its own
+    PyMuPDF and pdfplumber handles because open documents are not picklable.
+    """
+    page_texts = []
+    tables_found = []
+    with _open_documents(source) as (doc, pdf):
+        for texts, tables in _iter_page_batches(doc, pdf, start, end, batch_size):
+            page_texts.extend(texts)
+            tables_found.extend(tables)
+    return page_texts, tables_found
+
+
+@contextmanager
+def _open_documents(source: Union[str, bytes, mmap.mmap]) -> Iterator[Tuple[Any, Any]]:
+    """
+    Open a PDF with both PyMuPDF (text) and pdfplumber (metadata, tables).
+    
+    A path is memory-mapped so both parsers read straight from the kernel
+    page cache instead of going through their own read() buffers.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with _open_documents(mm) as documents:
+                yield documents
+        return
+    
+    # PyMuPDF reads the buffer in place through a memoryview; pdfplumber
+    # needs a seekable file object, which an mmap already is
+    view = memoryview(source)
+    fp = source if isinstance(source, mmap.mmap) else io.BytesIO(source)
+    try:
+        with pymupdf.open(stream=view, filetype="pdf") as doc, pdfplumber.open(fp) as pdf:
+            yield doc, pdf
+    finally:
+        # The view must be released before the mmap can be closed
+        view.release()
+
+
+def _iter_page_batches(doc, pdf, start: int, end: int, batch_size: Optional[int] = None) -> Iterator[PageResults]:
+    """
+    Yield (page_texts, tables) for pages [start, end) of an open PDF,
+    batch_size pages at a time (all at once if not given).
+    
+    Each page's cached layout objects are flushed once its batch is done.
+    """
+    batch_size = batch_size or max(end - start, 1)
+    for batch_start in range(start, end, batch_size):
+        batch_end = min(batch_start + batch_size, end)
+        yield _extract_pages(doc, pdf, batch_start, batch_end)
+        for page in pdf.pages[batch_start:batch_end]:
+            page.flush_cache()
+
+
+def _extract_pages(doc, pdf, start: int, end: int) -> PageResults:
+    """
+    Extract text and tables from pages [start, end) of an open PDF.
+    
+    doc is the PyMuPDF document used for text, pdf the pdfplumber one
+    used for tables.
+    """
+    page_texts = []
+    tables_found = []
+    
+    for page_num, page in enumerate(pdf.pages[start:end], start=start + 1):
+        # Extract text
+        page_text = doc[page_num - 1].get_text("text").strip()
+        if page_text:
+            page_texts.append((page_num, page_text))
+        
+        # Extract tables
+        tables = page.extract_tables()
+        if tables:
+            for table_num, table in enumerate(tables):
+                tables_found.append({
+                    "page": page_num,
+                    "table_number": table_num + 1,
+                    "data": table
+                })
+    
+    return page_texts, tables_found
 
 
 def extract_structured_data(text: str, tables: List[Dict]) -> Dict[str, Any]:
@@ -97,95 +383,112 @@ def extract_structured_data(text: str, tables: List[Dict]) -> Dict[str, Any]:
         "key_value_pairs": {},
         "tables_count": len(tables),
         "text_length": len(text),
-        "lines": text.split("\n")[:50]  # First 50 lines as sample
+        "lines": [m.group(0) for m in itertools.islice(_LINE_RE.finditer(text), 50)]  # First 50 lines as sample
     }
     
+    if not text:
+        return structured
+    
     # Example: Extract key-value pairs (customize based on your PDF)
-    # Look for patterns like "Key: Value" or "Key - Value"
-    lines = text.split("\n")
-    for line in lines:
-        if ":" in line:
-            parts = line.split(":", 1)
-            if len(parts) == 2:
-                key = parts[0].strip()
-                value = parts[1].strip()
-                if key and value:
-                    structured["key_value_pairs"][key] = value
+    # Look for patterns like "Key: Value"
+    # The first occurrence of a repeated key (e.g. "Page: 3") wins
+    key_value_pairs = structured["key_value_pairs"]
+    for m in _KV_RE.finditer(_head_lines(text, MAX_KV_LINES, MAX_KV_CHARS)):
+        key_value_pairs.setdefault(m.group(1), m.group(2))
     
     return structured
 
 
-def _detect_file_type(file_path: str) -> str:
-    """Detect if file is PDF or image"""
-    # Check file extension
-    ext = os.path.splitext(file_path)[1].lower()
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.heic', '.heif']
-    if ext in image_extensions:
-        return "image"
+def _head_lines(text: str, max_lines: int, max_chars: int) -> str:
+    """
+    The first max_lines lines of text, cut to at most max_chars characters.
     
-    # Try to read first bytes to check if it's actually a PDF
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(4)
-            # PDF files start with %PDF
-            if header[:4] == b'%PDF':
-                return "pdf"
-            # HEIC files start with specific bytes
-            if header[:4] == b'\x00\x00\x00\x24' or header[:8] == b'\x00\x00\x00\x20ftyp':
-                return "image"
-    except:
-        pass
+    A cut is made at the end of the last whole line that fits, unless even
+    the first line is longer than max_chars.
+    """
+    text = text[:max_chars + 1]
+    if text.count("\n") >= max_lines:
+        end = -1
+        for _ in range(max_lines):
+            end = text.find("\n", end + 1)
+        text = text[:end]
+    
+    if len(text) > max_chars:
+        end = text.rfind("\n", 0, max_chars + 1)
+        text = text[:end] if end != -1 else text[:max_chars]
+    return text
+
+
+def _detect_file_type(source: Union[str, bytes]) -> str:
+    """Detect if file (given by path or contents) is PDF or image"""
+    if isinstance(source, str):
+        # Check file extension
+        if os.path.splitext(source)[1].lower() in _IMAGE_EXTENSIONS:
+            return "image"
+        
+        # Otherwise go by the first bytes
+        try:
+            with open(source, 'rb') as f:
+                header = f.read(8)
+        except OSError:
+            header = b''
+    else:
+        header = source[:8]
+    
+    file_type = _MAGIC.get(header[:4]) or _MAGIC.get(header[:3]) or _MAGIC.get(header[:2])
+    if file_type:
+        return file_type
+    # HEIC and other ISO media files have an "ftyp" box right after its size
+    if header[4:8] == b'ftyp':
+        return "image"
     
     return "pdf"
 
 
-def _extract_from_image(image_path: str) -> Dict[str, Any]:
-    """Extract text from image using OCR"""
+def _extract_from_image(source: Union[str, bytes]) -> Tuple[Dict[str, Any], List[Tuple[int, str]]]:
+    """
+    Extract text from image (given by path or contents) using OCR.
+    
+    Returns the extracted data and (page_num, text) for each frame that
+    has text.
+    """
     extracted_data = {
         "raw_text": "",
         "tables": [],
         "metadata": {
             "file_type": "image",
-            "filename": os.path.basename(image_path)
+            "filename": os.path.basename(source) if isinstance(source, str) else None
         },
         "pages": 1,
         "structured_data": {}
     }
     
     try:
-        import subprocess
-        import tempfile
-        
-        # Use subprocess to call tesseract directly (avoids pandas dependency)
-        # First, convert HEIC to a format tesseract can handle if needed
-        from PIL import Image
-        
-        # Open and convert image if needed
-        img = Image.open(image_path)
+        # HEIC is handled by the registered pillow_heif opener
+        from PIL import Image, ImageSequence
         
-        # Convert to RGB if necessary (tesseract works better with RGB)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        # Open image and split multi-page images into frames
+        img = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        frames = [frame.copy() for frame in ImageSequence.Iterator(img)]
         
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_img:
-            img.save(tmp_img.name, 'PNG')
-            tmp_img_path = tmp_img.name
-        
-        try:
-            # Call tesseract directly via subprocess
-            result = subprocess.run(
-                ['tesseract', tmp_img_path, 'stdout', '-l', 'eng'],
-                capture_output=True,
-                text=True,
-                check=True
+        if len(frames) == 1:
+            texts = [_ocr_image(frames[0])]
+            extracted_data["raw_text"] = texts[0]
+        else:
+            # tesseract runs as a subprocess, so threads OCR frames in
+            # parallel; one OpenMP thread each stops them oversubscribing
+            # the CPU
+            env = dict(os.environ, OMP_THREAD_LIMIT="1")
+            with ThreadPoolExecutor(max_workers=min(OCR_MAX_WORKERS, len(frames))) as pool:
+                texts = list(pool.map(lambda frame: _ocr_image(frame, env), frames))
+            extracted_data["raw_text"] = "\n\n".join(
+                f"--- Page {page_num} ---\n{text.strip()}" for page_num, text in enumerate(texts, start=1)
             )
-            extracted_data["raw_text"] = result.stdout
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_img_path):
-                os.unlink(tmp_img_path)
+        
+        extracted_data["pages"] = len(frames)
+        page_texts = [
+            (page_num, text.strip()) for page_num, text in enumerate(texts, start=1) if text.strip()
+        ]
         
         # Extract structured data
         extracted_data["structured_data"] = extract_structured_data(
@@ -202,5 +505,25 @@ def _extract_from_image(image_path: str) -> Dict[str, Any]:
     except Exception as e:
         raise Exception(f"Error extracting from image: {str(e)}")
     
-    return extracted_data
+    return extracted_data, page_texts
+
 
+def _ocr_image(img, env: Optional[Dict[str, str]] = None) -> str:
+    """
+    Run tesseract on a PIL image, piping it in over stdin.
+    
+    The image is sent as uncompressed grayscale PGM, which is cheap to encode
+    and needs no temp file; tesseract binarizes it itself.
+    """
+    buf = io.BytesIO()
+    img.convert('L').save(buf, 'PPM')
+    
+    # Call tesseract directly via subprocess (avoids pandas dependency)
+    result = subprocess.run(
+        ['tesseract', 'stdin', 'stdout', '-l', 'eng', *TESSERACT_ARGS],
+        input=buf.getvalue(),
+        capture_output=True,
+        check=True,
+        env=env
+    )
+    return result.stdout.decode('utf-8')
@@ -0,0 +1,35 @@
+import time
+import unittest
+
+import pdf_extractor
+from pdf_extractor import extract_structured_data
+
+
+class ExtractStructuredDataTest(unittest.TestCase):
+    def test_key_value_pairs(self):
+        structured = extract_structured_data("Name:  Alice \n  Total : 12.5\nno pair here\nEmpty:\n", [])
+        self.assertEqual(structured["key_value_pairs"], {"Name": "Alice", "Total": "12.5"})
+
+    def test_long_whitespace_line_is_linear(self):
+        # Runs of spaces used to be re-scanned from every position, taking
+        # seconds on a single line like this
+        text = "k: a" + " " * 200_000 + "b\n" + "key" + " " * 200_000
+        start = time.perf_counter()
+        structured = extract_structured_data(text, [])
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(structured["key_value_pairs"], {"k": "a" + " " * 200_000 + "b"})
+
+    def test_key_value_search_is_capped(self):
+        text = "\n".join(f"k{i}: v" for i in range(pdf_extractor.MAX_KV_LINES + 10))
+        self.assertEqual(len(extract_structured_data(text, [])["key_value_pairs"]), pdf_extractor.MAX_KV_LINES)
+        
+        long_line = "k: " + "v" * pdf_extractor.MAX_KV_CHARS + "\nafter: x"
+        self.assertEqual(extract_structured_data(long_line, [])["key_value_pairs"], {"k": "v" * (pdf_extractor.MAX_KV_CHARS - 3)})
+
+    def test_repeated_key_keeps_first_value(self):
+        structured = extract_structured_data("Page: 1\nName: x\n\nPage: 2", [])
+        self.assertEqual(structured["key_value_pairs"], {"Page": "1", "Name": "x"})
+
+
+if __name__ == "__main__":
+    unittest.main()